@@ -13,3 +13,21 @@ LEARNING_PATHS_PATH = os.getenv("LEARNING_PATHS_PATH", "data/learning_paths.json
 COURSE_LEVELS_PATH = os.getenv("COURSE_LEVELS_PATH", "data/course_levels.json")
 TUTORIALS_PATH = os.getenv("TUTORIALS_PATH", "data/tutorials.json")
 
+# Chat History (Redis dipakai jika REDIS_URL di-set, selain itu file di chat_history/)
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "100"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
+
+# Semantic Response Cache (opsional, butuh sentence-transformers)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "500"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+
+# Exact-match LLM Response Cache
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "4096"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+
+# LLM Concurrency (per worker); LLM_RPM=0 berarti tanpa rate limit
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
@@ -1,19 +1,24 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from starlette.background import BackgroundTask
+from typing import AsyncIterator, Optional, List, Dict
+import asyncio
 import uuid
+import orjson
 from rag.pipeline import smart_answer
 from rag.history import get_history_manager
 from rag.recommendation import get_recommendation_engine
-from rag.tracking import get_tracker
+from rag.tracking import close_http_client, get_tracker
 from rag.data_loader import get_data_loader
+from rag.warmup import warmup
 
 app = FastAPI(
     title="Dicoding Personal Learning Assistant API",
     description="Smart Assistant with Progress Tracking, Chat History & Course Recommendations (No RAG)",
-    version="3.0.0"
+    version="3.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -25,6 +30,18 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def startup_warmup():
+    """Load data, prompts, clients and user progress before serving requests"""
+    await warmup()
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    """Close pooled HTTP connections"""
+    await close_http_client()
+
+
 class QueryIn(BaseModel):
     query: str
     session_id: Optional[str] = None
@@ -38,17 +55,6 @@ class HistoryResponse(BaseModel):
     session_id: str
     messages: List[dict]
 
-class SessionInfo(BaseModel):
-    session_id: str
-    created_at: Optional[str]
-    last_updated: Optional[str]
-    message_count: int
-
-class RecommendationResponse(BaseModel):
-    recommendations: List[Dict]
-    learning_paths_count: int
-    courses_count: int
-
 class ProgressResponse(BaseModel):
     user_name: str
     learning_path: str
@@ -59,14 +65,24 @@ class ProgressResponse(BaseModel):
     in_progress_details: List[Dict]
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(payload: QueryIn):
+async def chat(payload: QueryIn, background_tasks: BackgroundTasks):
     """
     Main chat endpoint - automatically routes to tracking/learning/recommendation
     based on query classification
     """
     try:
         session_id = payload.session_id or str(uuid.uuid4())
-        result = smart_answer(payload.query, session_id=session_id)
+        result = await smart_answer(payload.query, session_id=session_id)
+        
+        # Save to history after the response is sent
+        history_manager = get_history_manager()
+        background_tasks.add_task(
+            history_manager.save_message,
+            session_id=session_id,
+            query=payload.query,
+            answer=result["answer"],
+            query_type=result["type"]
+        )
         
         return ChatResponse(
             answer=result["answer"],
@@ -77,12 +93,108 @@ async def chat(payload: QueryIn):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Deltas arriving within this window are sent as one SSE event
+STREAM_BATCH_WINDOW_SECONDS = 0.05
+
+
+def _sse_event(data: dict) -> bytes:
+    """Encode one Server-Sent Event"""
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+async def _batch_chunks(
+    chunks: AsyncIterator[str],
+    window: float = STREAM_BATCH_WINDOW_SECONDS
+) -> AsyncIterator[str]:
+    """
+    Coalesce text chunks: the first chunk opens a window, and everything
+    that arrives before it closes is yielded as one string.
+    """
+    loop = asyncio.get_running_loop()
+    it = chunks.__aiter__()
+    pending: List[str] = []
+    flush_at = 0.0
+    next_chunk = None
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(it.__anext__())
+            timeout = max(0.0, flush_at - loop.time()) if pending else None
+            done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+            if not done:
+                # Window closed while waiting for the next chunk
+                yield "".join(pending)
+                pending.clear()
+                continue
+            
+            task, next_chunk = next_chunk, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+            if not pending:
+                flush_at = loop.time() + window
+            pending.append(chunk)
+        
+        if pending:
+            yield "".join(pending)
+    finally:
+        if next_chunk is not None:
+            next_chunk.cancel()
+
+
+@app.post("/chat/stream")
+async def chat_stream(payload: QueryIn):
+    """
+    Streaming chat endpoint (Server-Sent Events).
+    
+    Events (JSON in `data:`): first {"session_id", "type"}, then
+    {"delta": "..."} per chunk, then {"done": true}. On failure
+    {"error": "..."} is sent instead of done.
+    """
+    try:
+        session_id = payload.session_id or str(uuid.uuid4())
+        result = await smart_answer(payload.query, session_id=session_id, stream=True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    chunks: List[str] = []
+    
+    async def event_stream():
+        yield _sse_event({"session_id": session_id, "type": result["type"]})
+        try:
+            async for delta in _batch_chunks(result["answer"]):
+                chunks.append(delta)
+                yield _sse_event({"delta": delta})
+        except Exception as e:
+            chunks.clear()
+            yield _sse_event({"error": str(e)})
+            return
+        yield _sse_event({"done": True})
+    
+    async def save_history():
+        # Runs after the stream is sent; skip failed/empty answers
+        if chunks:
+            await get_history_manager().save_message(
+                session_id=session_id,
+                query=payload.query,
+                answer="".join(chunks),
+                query_type=result["type"]
+            )
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        background=BackgroundTask(save_history)
+    )
+
+
 @app.get("/history/{session_id}", response_model=HistoryResponse)
 async def get_history(session_id: str, limit: Optional[int] = None):
     """Get chat history for a specific session"""
     try:
         history_manager = get_history_manager()
-        messages = history_manager.get_history(session_id, limit=limit)
+        messages = await history_manager.get_history(session_id, limit=limit)
         
         return HistoryResponse(
             session_id=session_id,
@@ -96,7 +208,7 @@ async def clear_history(session_id: str):
     """Clear history for a specific session"""
     try:
         history_manager = get_history_manager()
-        deleted = history_manager.clear_session(session_id)
+        deleted = await history_manager.clear_session(session_id)
         
         if deleted:
             return {"message": "History cleared successfully", "session_id": session_id}
@@ -107,14 +219,12 @@ async def clear_history(session_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/sessions", response_model=List[SessionInfo])
+@app.get("/sessions")
 async def list_sessions():
     """List all chat sessions"""
     try:
         history_manager = get_history_manager()
-        sessions = history_manager.list_sessions()
-        
-        return [SessionInfo(**session) for session in sessions]
+        return await history_manager.list_sessions()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -123,11 +233,11 @@ async def clear_all_history():
     """Clear all chat history"""
     try:
         history_manager = get_history_manager()
-        sessions = history_manager.list_sessions()
+        sessions = await history_manager.list_sessions()
         
         deleted_count = 0
         for session in sessions:
-            if history_manager.clear_session(session["session_id"]):
+            if await history_manager.clear_session(session["session_id"]):
                 deleted_count += 1
         
         return {
@@ -137,7 +247,7 @@ async def clear_all_history():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/recommendations", response_model=RecommendationResponse)
+@app.get("/recommendations")
 async def get_recommendations(limit: int = 5):
     """
     Get course recommendations based on available learning paths
@@ -152,11 +262,11 @@ async def get_recommendations(limit: int = 5):
         all_paths = engine.get_all_learning_paths()
         all_courses = engine.data_loader.courses
         
-        return RecommendationResponse(
-            recommendations=recommendations,
-            learning_paths_count=len(all_paths),
-            courses_count=len(all_courses)
-        )
+        return {
+            "recommendations": recommendations,
+            "learning_paths_count": len(all_paths),
+            "courses_count": len(all_courses)
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -186,20 +296,8 @@ async def get_progress():
     """Get user's current learning progress"""
     try:
         tracker = get_tracker()
-        user = tracker.user_data["user"]
-        
-        completed = [c for c in user["courses"] if c["progress"] == 100]
-        in_progress = [c for c in user["courses"] if 0 < c["progress"] < 100]
-        
-        return ProgressResponse(
-            user_name=user["name"],
-            learning_path=user["learning_path"],
-            total_courses=len(user["courses"]),
-            completed_courses=len(completed),
-            in_progress_courses=len(in_progress),
-            completed_names=[c["course_name"] for c in completed],
-            in_progress_details=in_progress
-        )
+        await tracker.ensure_loaded()
+        return tracker.aggregates["progress"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -208,20 +306,8 @@ async def get_progress_summary():
     """Get a quick summary of user progress"""
     try:
         tracker = get_tracker()
-        user = tracker.user_data["user"]
-        
-        total = len(user["courses"])
-        completed = sum(1 for c in user["courses"] if c["progress"] == 100)
-        avg_progress = sum(c["progress"] for c in user["courses"]) / total if total > 0 else 0
-        
-        return {
-            "user_name": user["name"],
-            "learning_path": user["learning_path"],
-            "completion_rate": f"{(completed/total*100):.1f}%" if total > 0 else "0%",
-            "average_progress": f"{avg_progress:.1f}%",
-            "courses_completed": completed,
-            "courses_total": total
-        }
+        await tracker.ensure_loaded()
+        return tracker.aggregates["summary"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -317,6 +403,7 @@ async def root():
         "redoc": "/redoc",
         "endpoints": {
             "chat": "POST /chat",
+            "chat_stream": "POST /chat/stream",
             "recommendations": "GET /recommendations",
             "progress": "GET /progress",
             "history": "GET /history/{session_id}",
@@ -325,10 +412,10 @@ async def root():
     }
 
 
-# ✅ FIXED: Exception handlers sekarang return JSONResponse
+# ✅ FIXED: Exception handlers sekarang return ORJSONResponse
 @app.exception_handler(404)
 async def not_found_handler(request: Request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=404,
         content={
             "error": "Not Found",
@@ -339,7 +426,7 @@ async def not_found_handler(request: Request, exc):
 
 @app.exception_handler(500)
 async def internal_error_handler(request: Request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": "Internal Server Error",
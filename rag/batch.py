@@ -0,0 +1,45 @@
+"""
+Concurrency + rate limiting untuk LLM calls
+"""
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import asyncio
+
+from aiolimiter import AsyncLimiter
+
+from config import LLM_MAX_CONCURRENCY, LLM_RPM
+
+
+class BatchProcessor:
+    """
+    Admission control for Gemini calls shared by all requests in a worker.
+
+    Requests overlap freely on the event loop, but at most
+    `max_concurrency` calls are in flight at once and (optionally) at most
+    `rpm` calls start per minute, so bursts queue here instead of turning
+    into 429s from the API.
+    """
+
+    def __init__(self, max_concurrency: int = 16, rpm: int = 0):
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._rate = AsyncLimiter(rpm, 60) if rpm > 0 else None
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Wait for a free slot (and rate budget) for one LLM call"""
+        async with self._sem:
+            if self._rate is not None:
+                await self._rate.acquire()
+            yield
+
+
+# Singleton instance
+_batch_processor: Optional[BatchProcessor] = None
+
+def get_batch_processor() -> BatchProcessor:
+    """Get or create BatchProcessor instance"""
+    global _batch_processor
+    if _batch_processor is None:
+        _batch_processor = BatchProcessor(max_concurrency=LLM_MAX_CONCURRENCY, rpm=LLM_RPM)
+    return _batch_processor
@@ -0,0 +1,280 @@
+"""
+Response caches untuk LLM calls
+"""
+
+import asyncio
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import (
+    LLM_CACHE_SIZE,
+    LLM_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_MODEL,
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+)
+
+
+def _prompt_namespace(system_prompt: Optional[str], context_parts: Sequence[str] = ()) -> str:
+    """
+    Short hash of the system prompt + context parts, so answers are only
+    reused within the same handler and for the exact same context
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update((system_prompt or "").encode("utf-8"))
+    for part in context_parts:
+        h.update(b"\0")
+        h.update(part.encode("utf-8"))
+    return h.hexdigest()
+
+
+def cache_text(prompt: str, context_parts: Sequence[str] = ()) -> str:
+    """Full prompt text (context parts + prompt) that cache entries are keyed on"""
+    return "\n\n".join([*context_parts, prompt])
+
+
+def _prompt_key(prompt: str, system_prompt: Optional[str]) -> str:
+    """Hash of the full (system_prompt, prompt) pair"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update((system_prompt or "").encode("utf-8"))
+    h.update(b"\0")
+    h.update(prompt.encode("utf-8"))
+    return h.hexdigest()
+
+
+class ExactCache:
+    """LRU cache of LLM answers keyed by a hash of the exact prompt, with TTL"""
+
+    def __init__(self, maxsize: int = 4096, ttl_seconds: float = 3600):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        # key -> (expires_at, answer)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, prompt: str, system_prompt: Optional[str] = None) -> Optional[str]:
+        key = _prompt_key(prompt, system_prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, prompt: str, answer: str, system_prompt: Optional[str] = None) -> None:
+        key = _prompt_key(prompt, system_prompt)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, answer)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SemanticCache:
+    """
+    Reuse LLM answers for near-duplicate prompts.
+
+    Only the question is embedded (context blocks would dominate the
+    embedding, and the model truncates long inputs), and kept in a
+    fixed-size ring buffer. A lookup is a brute-force cosine similarity
+    (one matrix-vector product) over the buffer, restricted to entries
+    made with the same system prompt and context parts.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        size: int = 500,
+        threshold: float = 0.9
+    ):
+        from sentence_transformers import SentenceTransformer
+
+        self.encoder = SentenceTransformer(model_name)
+        self.size = size
+        self.threshold = threshold
+
+        dim = self.encoder.get_sentence_embedding_dimension()
+        self._vectors = np.zeros((size, dim), dtype=np.float32)
+        self._namespaces: List[Optional[str]] = [None] * size
+        self._answers: List[Optional[str]] = [None] * size
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, prompt: str) -> np.ndarray:
+        return self.encoder.encode(prompt, normalize_embeddings=True).astype(np.float32)
+
+    def lookup(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        context_parts: Sequence[str] = ()
+    ) -> Optional[str]:
+        """Return a cached answer if a similar enough prompt was seen, else None"""
+        namespace = _prompt_namespace(system_prompt, context_parts)
+        vector = self._embed(prompt)
+
+        with self._lock:
+            scores = self._vectors @ vector
+            for i in np.argsort(scores)[::-1]:
+                if scores[i] < self.threshold:
+                    break
+                if self._namespaces[i] == namespace:
+                    return self._answers[i]
+        return None
+
+    def add(
+        self,
+        prompt: str,
+        answer: str,
+        system_prompt: Optional[str] = None,
+        context_parts: Sequence[str] = ()
+    ) -> None:
+        """Store an answer, overwriting the oldest entry when full"""
+        vector = self._embed(prompt)
+
+        with self._lock:
+            i = self._next
+            self._vectors[i] = vector
+            self._namespaces[i] = _prompt_namespace(system_prompt, context_parts)
+            self._answers[i] = answer
+            self._next = (i + 1) % self.size
+
+
+# Singleton instances
+_exact_cache: Optional[ExactCache] = None
+
+def get_exact_cache() -> ExactCache:
+    """Get or create ExactCache instance"""
+    global _exact_cache
+    if _exact_cache is None:
+        _exact_cache = ExactCache(maxsize=LLM_CACHE_SIZE, ttl_seconds=LLM_CACHE_TTL_SECONDS)
+    return _exact_cache
+
+# None if disabled or sentence-transformers is unavailable
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_ready = False
+_semantic_cache_lock = threading.Lock()
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """
+    Get or create SemanticCache instance, None if semantic caching is off.
+
+    Built once at startup by warmup() (loading the embedding model is slow);
+    if that fails the cache stays disabled and requests are served without it.
+    """
+    global _semantic_cache, _semantic_cache_ready
+    if not _semantic_cache_ready:
+        with _semantic_cache_lock:
+            if not _semantic_cache_ready:
+                if SEMANTIC_CACHE_ENABLED:
+                    try:
+                        _semantic_cache = SemanticCache(
+                            SEMANTIC_CACHE_MODEL,
+                            size=SEMANTIC_CACHE_SIZE,
+                            threshold=SEMANTIC_CACHE_THRESHOLD
+                        )
+                    except ImportError:
+                        print("⚠️ Warning: sentence-transformers not installed, semantic cache disabled")
+                    except Exception as e:
+                        print(f"⚠️ Warning: Semantic cache init failed, semantic cache disabled: {e}")
+                _semantic_cache_ready = True
+    return _semantic_cache
+
+
+def exact_cache(func):
+    """Decorator for ask_llm: answer repeated identical prompts from ExactCache"""
+    @functools.wraps(func)
+    async def wrapper(
+        prompt: str,
+        system_prompt: str = None,
+        context_parts: Sequence[str] = (),
+        **kwargs
+    ):
+        cache = get_exact_cache()
+        text = cache_text(prompt, context_parts)
+
+        cached = cache.get(text, system_prompt)
+        if cached is not None:
+            return cached
+
+        answer = await func(prompt, system_prompt, context_parts, **kwargs)
+        cache.set(text, answer, system_prompt)
+        return answer
+
+    return wrapper
+
+
+def semantic_cache(func):
+    """Decorator for ask_llm: answer near-duplicate prompts from SemanticCache"""
+    @functools.wraps(func)
+    async def wrapper(
+        prompt: str,
+        system_prompt: str = None,
+        context_parts: Sequence[str] = (),
+        **kwargs
+    ):
+        if not SEMANTIC_CACHE_ENABLED:
+            return await func(prompt, system_prompt, context_parts, **kwargs)
+
+        cache = get_semantic_cache()
+        if cache is None:
+            return await func(prompt, system_prompt, context_parts, **kwargs)
+
+        # Embed only the question; the context goes into the namespace.
+        # Embedding is CPU-bound, keep it off the event loop
+        cached = await asyncio.to_thread(cache.lookup, prompt, system_prompt, context_parts)
+        if cached is not None:
+            return cached
+
+        answer = await func(prompt, system_prompt, context_parts, **kwargs)
+        await asyncio.to_thread(cache.add, prompt, answer, system_prompt, context_parts)
+        return answer
+
+    return wrapper
+
+
+# Calls currently running, by prompt key (singleflight)
+_inflight: Dict[str, "asyncio.Task"] = {}
+
+
+def coalesce_inflight(func):
+    """
+    Decorator for ask_llm: identical prompts issued while one is already in
+    flight await that call's result instead of calling the LLM again.
+
+    The call runs as its own task, so a caller that is cancelled (e.g. a
+    client disconnect) doesn't cancel it for the others waiting on it.
+    """
+    @functools.wraps(func)
+    async def wrapper(
+        prompt: str,
+        system_prompt: str = None,
+        context_parts: Sequence[str] = (),
+        **kwargs
+    ):
+        key = _prompt_key(cache_text(prompt, context_parts), system_prompt)
+
+        # No await between lookup and insert, so no lock is needed
+        task = _inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(prompt, system_prompt, context_parts, **kwargs))
+            _inflight[key] = task
+            task.add_done_callback(lambda _: _inflight.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    return wrapper
@@ -1,35 +1,164 @@
+import re
 from rag.llm import ask_llm
 from rag.prompt_loader import load_prompt
-from typing import Literal
+from typing import FrozenSet, Literal, Optional
 
 QueryType = Literal["tracking", "learning", "recommendation"]
+TrackingFocus = Literal["deadline", "completed", "progress"]
 
-def classify_query(query: str) -> QueryType:
+# Keyword rules only decide when they are unambiguous; everything else
+# goes to the (cached) LLM classifier. Generic words like "progress" or
+# "deadline" also appear in learning questions, so they need a
+# first-person anchor ("progress saya", "deadline-ku").
+
+# Queries up to this length with no tracking/recommendation signal are
+# learning questions (the LLM prompt's own default); longer ones go to the LLM
+LEARNING_DEFAULT_MAX_LENGTH = 120
+
+# Message that is only a greeting (optionally + "kak", "apa kabar", ...)
+_GREETING_RE = re.compile(
+    r"^\s*(halo+|hal+o|hai+|hi+|hello|hey|helo|assalamu\w*( \w+)*"
+    r"|selamat (pagi|siang|sore|malam)|pagi|siang|sore|malam)"
+    r"([\s,]+(kak|min|bro|sis|bot|semua|apa kabar))*[\s!.,?~]*$",
+    re.IGNORECASE,
+)
+
+_FIRST_PERSON = r"(saya|aku|ku|gue|gw)\b"
+
+_TRACKING_RE = re.compile(
+    r"\b("
+    rf"(progres+|deadline|tenggat|status|persentase)( (belajar|kursus|kelas|course))?-?\s*{_FIRST_PERSON}"
+    rf"|(kursus|kelas|course)(nya)?-?\s*{_FIRST_PERSON}"
+    rf"|(sampai|sejauh) mana (progres+ |belajar )?{_FIRST_PERSON}"
+    r"|(saya|aku) (sudah|udah|telah) (sampai mana|selesai\w*|menyelesaikan|belajar apa)"
+    r"|(sudah|udah|telah) (saya|aku) (selesai\w*|ambil|pelajari)"
+    r"|yang (sudah |udah )?(saya|aku) (selesaikan|ambil|pelajari)"
+    r"|(saya|aku) (terlambat|telat)"
+    r")",
+    re.IGNORECASE,
+)
+
+_COURSE = r"(kelas|kursus|course|materi|learning path)"
+
+_RECOMMENDATION_RE = re.compile(
+    r"\b("
+    r"rekomendasi\w*|rekomen\w*|recommend\w*|saran(kan)?\b"
+    rf"|{_COURSE} (selanjutnya|berikutnya)|next step|langkah (selanjutnya|berikutnya)"
+    r"|harus (saya |aku )?(pelajari|ambil|belajar)"
+    rf"|{_COURSE}( apa| mana)? yang (cocok|sesuai|tepat|bagus)"
+    rf"|{_COURSE} (apa|mana) yang (harus|sebaiknya|perlu)"
+    rf"|{_COURSE} (apa|mana) (yang )?(cocok|sesuai)"
+    r"|learning path (apa|mana)"
+    r")",
+    re.IGNORECASE,
+)
+
+# Explicit learning question phrasing ("apa itu", "jelaskan", ...)
+_LEARNING_RE = re.compile(
+    r"^\W*(tolong |coba |mohon )?("
+    r"apa (itu|yang dimaksud|maksud\w*)|apakah|jelaskan|jelasin|terangkan"
+    r"|bagaimana( cara)?|gimana( cara)?|cara|kenapa|mengapa|contoh|perbedaan|beda"
+    r"|bantu (saya |aku )?(memahami|paham|mengerti)|what is|how (to|do|does)|why|explain"
+    r")\b",
+    re.IGNORECASE,
+)
+
+# Tracking/recommendation words without the anchors above; a query using
+# them could be either, so it is left to the LLM
+_AMBIGUOUS_RE = re.compile(
+    r"\b(progres+|deadline|tenggat|status|persentase|selesai\w*|kelas|kursus|course"
+    r"|learning path|cocok|sesuai|selanjutnya|berikutnya|saran(kan)?\b|ambil)",
+    re.IGNORECASE,
+)
+
+
+# Focus of a tracking query, used to trim the progress context
+_TRACKING_FOCUS_RES = (
+    ("deadline", re.compile(
+        r"\b(deadline|tenggat|batas waktu|terlambat|telat|jatuh tempo)",
+        re.IGNORECASE,
+    )),
+    ("completed", re.compile(
+        r"\b((sudah|udah|telah) (saya |aku )?(selesai\w*|menyelesaikan)"
+        r"|(saya|aku) selesaikan|selesai berapa|yang (sudah |udah )?selesai|lulus)",
+        re.IGNORECASE,
+    )),
+    ("progress", re.compile(
+        r"\b(progres+|sampai mana|sejauh mana|berapa persen|persentase"
+        r"|sedang berjalan|belum (saya |aku )?(selesai\w*|mulai|dimulai))",
+        re.IGNORECASE,
+    )),
+)
+
+
+# Resolved once at import: system prompt + bound formatter for the user prompt
+_SYSTEM_PROMPT = load_prompt("classifier")
+_CLASSIFY_TMPL = """Klasifikasikan pertanyaan berikut:
+
+"{q}"
+
+Jawab hanya dengan satu kata: tracking, learning, atau recommendation""".format
+
+
+def classify_query_fast(query: str) -> Optional[QueryType]:
+    """
+    Classify a query with keyword rules only (no LLM call).
+
+    Returns:
+        The query type, or None if no rule is unambiguous
+        (the caller then asks the LLM)
+    """
+    if _TRACKING_RE.search(query):
+        return "tracking"
+    if _RECOMMENDATION_RE.search(query):
+        return "recommendation"
+    if _GREETING_RE.match(query):
+        return "learning"
+    if _AMBIGUOUS_RE.search(query):
+        return None
+    if _LEARNING_RE.match(query) or len(query) <= LEARNING_DEFAULT_MAX_LENGTH:
+        return "learning"
+    return None
+
+
+def classify_tracking_focus(query: str) -> FrozenSet[TrackingFocus]:
+    """
+    Sub-classify a tracking query by keyword rules.
+
+    Returns:
+        What the query asks about ("deadline", "completed", "progress");
+        empty if no rule matched, meaning the full progress context is needed
+    """
+    return frozenset(focus for focus, pattern in _TRACKING_FOCUS_RES if pattern.search(query))
+
+
+async def classify_query(query: str) -> QueryType:
     """
     Classify user query into 'tracking', 'learning', or 'recommendation' category.
-    
+
+    Keyword rules are tried first; the LLM is only asked when they are
+    not confident.
+
     Args:
         query: User's question
-    
+
     Returns:
         'tracking' if asking about progress/courses completed
         'learning' if asking for study material/explanations
         'recommendation' if asking for course suggestions/next steps
     """
-    system_prompt = load_prompt("classifier")
-    
-    prompt = f"""Klasifikasikan pertanyaan berikut:
+    query_type = classify_query_fast(query)
+    if query_type is not None:
+        return query_type
+
+    prompt = _CLASSIFY_TMPL(q=query)
 
-"{query}"
+    response = (await ask_llm(prompt, system_prompt=_SYSTEM_PROMPT)).strip().lower()
 
-Jawab hanya dengan satu kata: tracking, learning, atau recommendation"""
-    
-    response = ask_llm(prompt, system_prompt=system_prompt).strip().lower()
-    
     # Extract the classification from response
     if "tracking" in response:
         return "tracking"
     elif "recommendation" in response:
         return "recommendation"
     else:
-        return "learning"  # Default to learning if unclear
\ No newline at end of file
+        return "learning"  # Default to learning if unclear
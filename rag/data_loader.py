@@ -1,7 +1,25 @@
-import json
+import mmap
+import os
+import orjson
+import threading
 from typing import Dict, List, Optional
 from pathlib import Path
 
+# Files larger than this are stream-parsed with ijson instead of loaded in one go
+STREAM_PARSE_MIN_BYTES = 10_000_000
+# Files larger than this (but below the streaming threshold) are memory-mapped
+MMAP_MIN_BYTES = 4_000_000
+# Read buffer for regular loads
+READ_BUFFER_SIZE = 1024 * 1024
+
+def _group_by(items: List[Dict], key: str) -> Dict[int, List[Dict]]:
+    """Build an index of items grouped by the value of `key`"""
+    index: Dict[int, List[Dict]] = {}
+    for item in items:
+        index.setdefault(item.get(key), []).append(item)
+    return index
+
+
 class DataLoader:
     """Centralized data loader for all JSON files"""
     
@@ -27,16 +45,39 @@ class DataLoader:
         self._course_by_id: Optional[Dict[int, Dict]] = None
         self._path_by_id: Optional[Dict[int, Dict]] = None
         self._level_by_id: Optional[Dict[int, Dict]] = None
+        
+        # Inverted indexes for filtered lookups
+        self._courses_by_path: Optional[Dict[int, List[Dict]]] = None
+        self._tutorials_by_course: Optional[Dict[int, List[Dict]]] = None
+    
+    def _stream_json(self, path: str) -> List[Dict]:
+        """Stream-parse a top-level JSON array item by item (low peak memory)"""
+        import ijson
+        
+        try:
+            with open(path, "rb") as f:
+                return list(ijson.items(f, "item", use_float=True))
+        except ijson.JSONError as e:
+            raise ValueError(str(e)) from e
     
     def _load_json(self, path: str) -> List[Dict]:
         """Load JSON file with error handling"""
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            size = os.path.getsize(path)
+            if size > STREAM_PARSE_MIN_BYTES:
+                return self._stream_json(path)
+            
+            with open(path, "rb", buffering=READ_BUFFER_SIZE) as f:
+                if size > MMAP_MIN_BYTES:
+                    # Parse straight from the page cache, no intermediate bytes copy
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        with memoryview(mm) as view:
+                            return orjson.loads(view)
+                return orjson.loads(f.read())
         except FileNotFoundError:
             print(f"⚠️ Warning: {path} not found, returning empty list")
             return []
-        except json.JSONDecodeError as e:
+        except ValueError as e:
             print(f"⚠️ Warning: Invalid JSON in {path}: {e}")
             return []
     
@@ -68,6 +109,14 @@ class DataLoader:
             self._tutorials = self._load_json(self.tutorials_path)
         return self._tutorials
     
+    def build_indexes(self) -> None:
+        """Build all lookup dictionaries and inverted indexes up front"""
+        self._course_by_id = {c["course_id"]: c for c in self.courses}
+        self._path_by_id = {p["learning_path_id"]: p for p in self.learning_paths}
+        self._level_by_id = {l["id"]: l for l in self.course_levels}
+        self._courses_by_path = _group_by(self.courses, "learning_path_id")
+        self._tutorials_by_course = _group_by(self.tutorials, "course_id")
+    
     def get_course_by_id(self, course_id: int) -> Optional[Dict]:
         """Get course by ID"""
         if self._course_by_id is None:
@@ -88,17 +137,15 @@ class DataLoader:
     
     def get_courses_by_learning_path(self, learning_path_id: int) -> List[Dict]:
         """Get all courses for a specific learning path"""
-        return [
-            c for c in self.courses 
-            if c.get("learning_path_id") == learning_path_id
-        ]
+        if self._courses_by_path is None:
+            self._courses_by_path = _group_by(self.courses, "learning_path_id")
+        return self._courses_by_path.get(learning_path_id, [])
     
     def get_tutorials_by_course(self, course_id: int) -> List[Dict]:
         """Get all tutorials for a specific course"""
-        return [
-            t for t in self.tutorials
-            if t.get("course_id") == course_id
-        ]
+        if self._tutorials_by_course is None:
+            self._tutorials_by_course = _group_by(self.tutorials, "course_id")
+        return self._tutorials_by_course.get(course_id, [])
     
     def get_level_name(self, level_id: int) -> str:
         """Get level name by ID"""
@@ -113,10 +160,13 @@ class DataLoader:
 
 # Singleton instance
 _data_loader = None
+_data_loader_lock = threading.Lock()
 
 def get_data_loader() -> DataLoader:
     """Get or create DataLoader instance"""
     global _data_loader
     if _data_loader is None:
-        _data_loader = DataLoader()
+        with _data_loader_lock:
+            if _data_loader is None:
+                _data_loader = DataLoader()
     return _data_loader
\ No newline at end of file
@@ -1,35 +1,224 @@
-import json
+import asyncio
+import aiofiles
+import aiofiles.os
+import orjson
 import os
+import threading
+from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
+from config import REDIS_URL, SESSION_MAX_MESSAGES, SESSION_TTL_SECONDS
+
+# Bytes read from the end of a log when only the last N messages are needed
+TAIL_READ_BYTES = 64 * 1024
+
+# Redis key prefixes; the (client-supplied) session id is always the suffix
+MESSAGES_KEY_PREFIX = "chat:msgs:"
+META_KEY_PREFIX = "chat:meta:"
+
+
+def _parse_lines(data: bytes) -> List[Dict]:
+    """Parse newline-delimited JSON, skipping blank lines"""
+    return [orjson.loads(line) for line in data.splitlines() if line.strip()]
+
+
+def _log_summary(session_file: Path) -> Dict:
+    """Session info derived from a JSONL log (message count, first/last timestamps)"""
+    with open(session_file, "rb") as f:
+        data = f.read()
+
+    lines = [line for line in data.splitlines() if line.strip()]
+    return {
+        "session_id": session_file.name[:-len(".jsonl")],
+        "created_at": orjson.loads(lines[0]).get("timestamp") if lines else None,
+        "last_updated": orjson.loads(lines[-1]).get("timestamp") if lines else None,
+        "message_count": len(lines)
+    }
+
+
+def format_conversation_context(messages: List[Dict]) -> str:
+    """Format recent messages as a conversation history block for the LLM"""
+    if not messages:
+        return ""
+
+    context_parts = ["RIWAYAT PERCAKAPAN SEBELUMNYA:"]
+
+    for msg in messages:
+        context_parts.append(f"\nUser: {msg['query']}")
+
+        # ✅ FIX: Jangan truncate answer, atau perbesar limitnya
+        answer = msg['answer']
+        if len(answer) > 500:  # Naik dari 200 ke 500
+            answer = answer[:500] + "..."
+
+        context_parts.append(f"Dico: {answer}")
+
+    context_parts.append("\n---\nPERTANYAAN SAAT INI MUNGKIN TERKAIT DENGAN PERCAKAPAN DI ATAS.\n")
+
+    return "\n".join(context_parts)
+
+
+class BaseChatHistory(ABC):
+    """History backend interface + shared behaviour (conversation context)"""
+
+    @abstractmethod
+    async def save_message(
+        self,
+        session_id: str,
+        query: str,
+        answer: str,
+        query_type: str,
+        metadata: Optional[Dict] = None
+    ) -> None:
+        """Append a chat message to a session"""
+
+    @abstractmethod
+    async def get_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Messages of a session, oldest first (only the last `limit` if given)"""
+
+    @abstractmethod
+    async def clear_session(self, session_id: str) -> bool:
+        """Delete a session; False if it didn't exist"""
+
+    @abstractmethod
+    async def list_sessions(self) -> List[Dict]:
+        """Info of all sessions (most recently updated first)"""
+
+    async def get_conversation_context(
+        self,
+        session_id: str,
+        last_n: int = 5
+    ) -> str:
+        """
+        Get formatted conversation context for LLM.
+
+        Args:
+            session_id: Session identifier
+            last_n: Number of recent messages to include
+
+        Returns:
+            Formatted conversation history string
+        """
+        messages = await self.get_history(session_id, limit=last_n)
+        return format_conversation_context(messages)
+
+
+class ChatHistory(BaseChatHistory):
+    # Max number of (session_id, last_n) contexts kept in memory
+    CONTEXT_CACHE_SIZE = 1024
 
-class ChatHistory:
     def __init__(self, storage_dir: str = "chat_history"):
         """
         Initialize chat history manager.
-        
+
+        Each session is stored as an append-only JSONL log
+        ({session_id}.jsonl, one message per line). Session info (message
+        count, timestamps) is derived from the log, so there is nothing
+        else to keep in sync between workers.
+
         Args:
             storage_dir: Directory to store chat history files
         """
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(exist_ok=True)
-    
+        # (session_id, last_n) -> ((log size, log mtime), formatted context)
+        self._ctx_cache: "OrderedDict[Tuple[str, int], Tuple[Tuple[int, int], str]]" = OrderedDict()
+
     def _get_session_file(self, session_id: str) -> Path:
-        """Get file path for a session"""
-        return self.storage_dir / f"{session_id}.json"
-    
-    def save_message(
-        self, 
-        session_id: str, 
-        query: str, 
-        answer: str, 
+        """Get message log path for a session"""
+        return self.storage_dir / f"{session_id}.jsonl"
+
+    def migrate_legacy_sessions(self) -> None:
+        """
+        Convert old single-document {session_id}.json files to JSONL logs.
+
+        One-off: run `python -m rag.history` once, with the app stopped
+        (not at startup, where every worker would race on the same files).
+        """
+        for legacy_file in self.storage_dir.glob("*.json"):
+            try:
+                with open(legacy_file, "rb") as f:
+                    history = orjson.loads(f.read())
+
+                session_id = history["session_id"]
+                messages = history.get("messages", [])
+
+                with open(self._get_session_file(session_id), "wb") as f:
+                    f.write(b"".join(orjson.dumps(m) + b"\n" for m in messages))
+
+                legacy_file.unlink()
+            except Exception as e:
+                print(f"Error migrating session {legacy_file}: {e}")
+
+    async def _read_tail(self, session_file: Path, limit: int) -> List[Dict]:
+        """Read only the last `limit` messages using a bounded read from the end of the log"""
+        async with aiofiles.open(session_file, "rb") as f:
+            size = await f.seek(0, os.SEEK_END)
+            start = max(0, size - TAIL_READ_BYTES)
+            await f.seek(start)
+            data = await f.read()
+
+            if start > 0:
+                # Drop the partial line at the start of the window
+                data = data[data.find(b"\n") + 1:]
+                if data.count(b"\n") < limit:
+                    # Window too small for the requested messages, read everything
+                    await f.seek(0)
+                    data = await f.read()
+
+        messages = await asyncio.to_thread(_parse_lines, data)
+        return messages[-limit:]
+
+    async def get_conversation_context(
+        self,
+        session_id: str,
+        last_n: int = 5
+    ) -> str:
+        """
+        Get formatted conversation context for LLM.
+
+        The formatted string is cached per (session_id, last_n) and tagged
+        with the log's size and mtime, so checking it costs one stat and it
+        is rebuilt only after the log changes (also when written by another
+        worker).
+        """
+        session_file = self._get_session_file(session_id)
+        try:
+            stat = await aiofiles.os.stat(session_file)
+        except FileNotFoundError:
+            return ""
+
+        key = (session_id, last_n)
+        version = (stat.st_size, stat.st_mtime_ns)
+
+        cached = self._ctx_cache.get(key)
+        if cached is not None and cached[0] == version:
+            self._ctx_cache.move_to_end(key)
+            return cached[1]
+
+        messages = await self._read_tail(session_file, last_n)
+        context = format_conversation_context(messages)
+
+        self._ctx_cache[key] = (version, context)
+        self._ctx_cache.move_to_end(key)
+        if len(self._ctx_cache) > self.CONTEXT_CACHE_SIZE:
+            self._ctx_cache.popitem(last=False)
+
+        return context
+
+    async def save_message(
+        self,
+        session_id: str,
+        query: str,
+        answer: str,
         query_type: str,
         metadata: Optional[Dict] = None
     ) -> None:
         """
         Save a chat message to history.
-        
+
         Args:
             session_id: Unique session identifier
             query: User's question
@@ -37,19 +226,6 @@ class ChatHistory:
             query_type: Type of query ('tracking' or 'learning')
             metadata: Additional metadata (e.g., timestamp, user_id)
         """
-        session_file = self._get_session_file(session_id)
-        
-        # Load existing history
-        if session_file.exists():
-            with open(session_file, "r", encoding="utf-8") as f:
-                history = json.load(f)
-        else:
-            history = {
-                "session_id": session_id,
-                "created_at": datetime.now().isoformat(),
-                "messages": []
-            }
-        
         # Add new message
         message = {
             "timestamp": datetime.now().isoformat(),
@@ -57,133 +233,208 @@ class ChatHistory:
             "answer": answer,
             "type": query_type
         }
-        
+
         if metadata:
             message["metadata"] = metadata
-        
-        history["messages"].append(message)
-        history["last_updated"] = datetime.now().isoformat()
-        
-        # Save to file
-        with open(session_file, "w", encoding="utf-8") as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-    
-    def get_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
+
+        # Append a single line to the log
+        async with aiofiles.open(self._get_session_file(session_id), "ab") as f:
+            await f.write(orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS) + b"\n")
+
+    async def get_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
         """
         Get chat history for a session.
-        
+
         Args:
             session_id: Session identifier
             limit: Maximum number of recent messages to return
-            
+
         Returns:
             List of messages (most recent first if limit is set)
         """
         session_file = self._get_session_file(session_id)
-        
-        if not session_file.exists():
+
+        if not await aiofiles.os.path.exists(session_file):
             return []
-        
-        with open(session_file, "r", encoding="utf-8") as f:
-            history = json.load(f)
-        
-        messages = history.get("messages", [])
-        
+
         if limit:
-            messages = messages[-limit:]
-        
-        return messages
-    
-    def get_conversation_context(
-        self, 
-        session_id: str, 
-        last_n: int = 5
-    ) -> str:
-        """
-        Get formatted conversation context for LLM.
-        
-        Args:
-            session_id: Session identifier
-            last_n: Number of recent messages to include
-            
-        Returns:
-            Formatted conversation history string
-        """
-        messages = self.get_history(session_id, limit=last_n)
-        
-        if not messages:
-            return ""
-        
-        context_parts = ["RIWAYAT PERCAKAPAN SEBELUMNYA:"]
-        
-        for msg in messages:
-            context_parts.append(f"\nUser: {msg['query']}")
-            
-            # ✅ FIX: Jangan truncate answer, atau perbesar limitnya
-            answer = msg['answer']
-            if len(answer) > 500:  # Naik dari 200 ke 500
-                answer = answer[:500] + "..."
-            
-            context_parts.append(f"Dico: {answer}")
-        
-        context_parts.append("\n---\nPERTANYAAN SAAT INI MUNGKIN TERKAIT DENGAN PERCAKAPAN DI ATAS.\n")
-        
-        return "\n".join(context_parts)
-    
-    def clear_session(self, session_id: str) -> bool:
+            return await self._read_tail(session_file, limit)
+
+        async with aiofiles.open(session_file, "rb") as f:
+            data = await f.read()
+
+        return await asyncio.to_thread(_parse_lines, data)
+
+    async def clear_session(self, session_id: str) -> bool:
         """
         Clear history for a specific session.
-        
+
         Args:
             session_id: Session identifier
-            
+
         Returns:
             True if deleted, False if session doesn't exist
         """
-        session_file = self._get_session_file(session_id)
-        
-        if session_file.exists():
-            session_file.unlink()
-            return True
-        
-        return False
-    
-    def list_sessions(self) -> List[Dict]:
+        try:
+            await aiofiles.os.remove(self._get_session_file(session_id))
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    async def _session_info(self, session_file: Path) -> Optional[Dict]:
+        """Read summary info for one session, None if unreadable"""
+        try:
+            return await asyncio.to_thread(_log_summary, session_file)
+        except Exception as e:
+            print(f"Error reading session {session_file}: {e}")
+            return None
+
+    async def list_sessions(self) -> List[Dict]:
         """
         List all available sessions.
-        
+
         Returns:
             List of session info (id, created_at, message_count)
         """
+        results = await asyncio.gather(
+            *(self._session_info(f) for f in self.storage_dir.glob("*.jsonl"))
+        )
+        sessions = [s for s in results if s is not None]
+
+        # Sort by last updated (most recent first)
+        sessions.sort(key=lambda x: x.get("last_updated") or "", reverse=True)
+
+        return sessions
+
+
+class RedisChatHistory(BaseChatHistory):
+    def __init__(
+        self,
+        redis_url: str,
+        max_messages: int = 100,
+        ttl_seconds: int = 86400
+    ):
+        """
+        Redis-backed chat history manager, shared by all workers/instances.
+
+        Messages live in a rolling list `chat:msgs:{id}` (last `max_messages`
+        kept) and session info in a `chat:meta:{id}` hash. Both expire
+        after `ttl_seconds` of inactivity. The session id is client-supplied,
+        so it only ever appears as the key suffix: no id can produce another
+        session's key.
+
+        Args:
+            redis_url: Redis connection URL (redis://...)
+            max_messages: Number of recent messages kept per session
+            ttl_seconds: Session expiry in seconds
+        """
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(redis_url)
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+
+    def _get_session_key(self, session_id: str) -> str:
+        """Get message list key for a session"""
+        return f"{MESSAGES_KEY_PREFIX}{session_id}"
+
+    def _get_meta_key(self, session_id: str) -> str:
+        """Get metadata hash key for a session"""
+        return f"{META_KEY_PREFIX}{session_id}"
+
+    async def save_message(
+        self,
+        session_id: str,
+        query: str,
+        answer: str,
+        query_type: str,
+        metadata: Optional[Dict] = None
+    ) -> None:
+        """Save a chat message to history (see ChatHistory.save_message)"""
+        session_key = self._get_session_key(session_id)
+        meta_key = self._get_meta_key(session_id)
+        now = datetime.now().isoformat()
+
+        message = {
+            "timestamp": now,
+            "query": query,
+            "answer": answer,
+            "type": query_type
+        }
+
+        if metadata:
+            message["metadata"] = metadata
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(session_key, orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS))
+            pipe.ltrim(session_key, -self.max_messages, -1)
+            pipe.hsetnx(meta_key, "created_at", now)
+            pipe.hset(meta_key, mapping={"session_id": session_id, "last_updated": now})
+            pipe.hincrby(meta_key, "message_count", 1)
+            pipe.expire(session_key, self.ttl_seconds)
+            pipe.expire(meta_key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def get_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Get chat history for a session (see ChatHistory.get_history)"""
+        start = -limit if limit else 0
+        raw = await self.redis.lrange(self._get_session_key(session_id), start, -1)
+        return [orjson.loads(m) for m in raw]
+
+    async def clear_session(self, session_id: str) -> bool:
+        """Clear history for a specific session"""
+        deleted = await self.redis.delete(
+            self._get_session_key(session_id),
+            self._get_meta_key(session_id)
+        )
+        return deleted > 0
+
+    async def list_sessions(self) -> List[Dict]:
+        """List all available sessions (most recently updated first)"""
+        meta_keys = [key async for key in self.redis.scan_iter(match=f"{META_KEY_PREFIX}*")]
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in meta_keys:
+                pipe.hmget(key, "session_id", "created_at", "last_updated", "message_count")
+            results = await pipe.execute()
+
         sessions = []
-        
-        for session_file in self.storage_dir.glob("*.json"):
-            try:
-                with open(session_file, "r", encoding="utf-8") as f:
-                    history = json.load(f)
-                
-                sessions.append({
-                    "session_id": history["session_id"],
-                    "created_at": history.get("created_at"),
-                    "last_updated": history.get("last_updated"),
-                    "message_count": len(history.get("messages", []))
-                })
-            except Exception as e:
-                print(f"Error reading session {session_file}: {e}")
+        for session_id, created_at, last_updated, message_count in results:
+            if session_id is None:
                 continue
-        
-        # Sort by last updated (most recent first)
-        sessions.sort(key=lambda x: x.get("last_updated", ""), reverse=True)
-        
+            sessions.append({
+                "session_id": session_id.decode(),
+                "created_at": created_at.decode() if created_at else None,
+                "last_updated": last_updated.decode() if last_updated else None,
+                "message_count": int(message_count or 0)
+            })
+
+        sessions.sort(key=lambda x: x.get("last_updated") or "", reverse=True)
+
         return sessions
 
 
 # Singleton instance
 _history_manager = None
+_history_manager_lock = threading.Lock()
 
-def get_history_manager() -> ChatHistory:
-    """Get or create ChatHistory instance"""
+def get_history_manager() -> BaseChatHistory:
+    """Get or create the history manager (Redis if REDIS_URL is set, else files)"""
     global _history_manager
     if _history_manager is None:
-        _history_manager = ChatHistory()
-    return _history_manager
\ No newline at end of file
+        with _history_manager_lock:
+            if _history_manager is None:
+                if REDIS_URL:
+                    _history_manager = RedisChatHistory(
+                        REDIS_URL,
+                        max_messages=SESSION_MAX_MESSAGES,
+                        ttl_seconds=SESSION_TTL_SECONDS
+                    )
+                else:
+                    _history_manager = ChatHistory()
+    return _history_manager
+
+
+if __name__ == "__main__":
+    ChatHistory().migrate_legacy_sessions()
@@ -1,19 +1,227 @@
+import asyncio
+import functools
+import random
 import time
-import google.generativeai as genai
-from google.api_core import exceptions as google_exceptions
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Sequence
 from config import MODEL_NAME, GEMINI_API_KEY
+from rag.batch import get_batch_processor
+from rag.cache import (
+    cache_text,
+    coalesce_inflight,
+    exact_cache,
+    get_exact_cache,
+    semantic_cache,
+)
 
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel(MODEL_NAME)
+# google.generativeai (gRPC, protobuf, auth) is imported on first use,
+# not when the rag package is imported
+if TYPE_CHECKING:
+    import google.generativeai as genai
 
+# Process-wide model; its gRPC client (and connection) is shared by every call
+_model: Optional["genai.GenerativeModel"] = None
 
-def ask_llm(prompt: str, system_prompt: str = None, max_retries: int = 3):
+# Circuit breaker: after this many consecutive failed calls to Gemini,
+# new calls fail fast for the cooldown instead of piling on retries
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_SECONDS = 20.0
+MAX_BACKOFF_SECONDS = 30.0
+
+_breaker = {"fails": 0, "open_until": 0.0}
+
+
+def init_llm() -> "genai.GenerativeModel":
+    """
+    Configure Gemini and create the shared model + async client.
+
+    Call this after the worker process has started (FastAPI startup), so
+    each worker opens its own long-lived channel on its own event loop
+    instead of inheriting one across fork.
+    """
+    global _model
+    if _model is None:
+        import google.generativeai as genai
+        from google.generativeai import client as genai_client
+
+        genai.configure(api_key=GEMINI_API_KEY)
+        _model = genai.GenerativeModel(MODEL_NAME)
+        # Open the cached async client now rather than on the first request
+        genai_client.get_default_generative_async_client()
+    return _model
+
+
+def get_model() -> "genai.GenerativeModel":
+    """Get the shared model, initializing it on first use"""
+    return _model if _model is not None else init_llm()
+
+
+@functools.lru_cache(maxsize=8)
+def _model_for(system_prompt: str) -> "genai.GenerativeModel":
+    """Model with system_instruction set, one per distinct system prompt"""
+    get_model()  # genai.configure + shared async client
+    import google.generativeai as genai
+    return genai.GenerativeModel(MODEL_NAME, system_instruction=system_prompt)
+
+
+def _select_model(system_prompt: Optional[str]) -> "genai.GenerativeModel":
+    return _model_for(system_prompt) if system_prompt else get_model()
+
+
+def _check_breaker() -> None:
+    """Fail fast while the circuit breaker is open"""
+    if time.monotonic() < _breaker["open_until"]:
+        raise RuntimeError(
+            "Layanan AI sedang tidak tersedia. Silakan coba beberapa saat lagi."
+        )
+
+
+def _record_success() -> None:
+    _breaker["fails"] = 0
+
+
+def _record_failure() -> None:
+    _breaker["fails"] += 1
+    if _breaker["fails"] >= BREAKER_FAILURE_THRESHOLD:
+        _breaker["open_until"] = time.monotonic() + BREAKER_COOLDOWN_SECONDS
+        print(f"[LLM] Circuit breaker open for {BREAKER_COOLDOWN_SECONDS:.0f} detik "
+              f"after {_breaker['fails']} consecutive failures")
+
+
+def _backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, 2 ** attempt))
+
+
+# Retry classification of errors raised by the Gemini client. The
+# google.api_core exception classes are matched by name (anywhere in the
+# error's class hierarchy) so they don't have to be imported here
+_SAFETY_KEYWORDS = ("block", "safety", "finish_reason")
+_RETRYABLE_API_KEYWORDS = ("timeout", "connection", "503")
+_CONNECTION_ERRORS = frozenset(("ServiceUnavailable", "DeadlineExceeded", "InternalServerError"))
+
+# Retryable kinds -> log label / message once retries are exhausted
+_RETRY_LABELS = {
+    "rate_limit": "Rate limited",
+    "connection": "Connection error",
+    "api": "API error",
+    "unexpected": "Unexpected error",
+}
+_GIVE_UP_MESSAGES = {
+    "rate_limit": "API quota exceeded atau rate limit. Silakan coba beberapa saat lagi.",
+    "connection": (
+        "Tidak dapat terhubung ke server AI setelah {n} percobaan. "
+        "Silakan coba lagi nanti."
+    ),
+    "api": "API error setelah {n} percobaan: {error}",
+    "unexpected": "Failed to get response from LLM after {n} attempts. Error: {error}",
+}
+# Kinds that point at the Gemini service itself and count toward the breaker
+_BREAKER_KINDS = frozenset(("rate_limit", "connection", "api"))
+# Stream finish reasons that mean the answer was cut off by a content filter
+_BLOCKED_FINISH_REASONS = frozenset((
+    "SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII", "IMAGE_SAFETY"
+))
+_SAFETY_MESSAGE = (
+    "Response tidak bisa diproses karena melanggar content policy. "
+    "Mohon ajukan pertanyaan yang berbeda."
+)
+
+
+def _class_names(e: Exception) -> frozenset:
+    return frozenset(cls.__name__ for cls in type(e).__mro__)
+
+
+def _classify(e: Exception) -> str:
+    """
+    Classify an error from generate_content.
+
+    Returns:
+        "safety" (blocked response), "raise" (other ValueError, re-raised as is),
+        "fatal" (non-retryable API error), or a retryable kind from _RETRY_LABELS
+    """
+    if isinstance(e, ValueError):
+        error_str = str(e).lower()
+        return "safety" if any(k in error_str for k in _SAFETY_KEYWORDS) else "raise"
+
+    names = _class_names(e)
+    if "ResourceExhausted" in names:
+        return "rate_limit"
+    if not _CONNECTION_ERRORS.isdisjoint(names):
+        return "connection"
+    if "GoogleAPIError" in names:
+        error_str = str(e).lower()
+        return "api" if any(k in error_str for k in _RETRYABLE_API_KEYWORDS) else "fatal"
+    return "unexpected"
+
+
+def _retry_delay(e: Exception, attempt: int, max_retries: int) -> float:
+    """
+    Handle a failed generate_content call.
+
+    Raises for non-retryable errors and once retries are exhausted;
+    otherwise returns how long to wait before the next attempt.
+    """
+    kind = _classify(e)
+    
+    if kind == "safety":
+        print(f"[LLM Warning] Response blocked by safety filter: {e}")
+        raise ValueError(_SAFETY_MESSAGE)
+    if kind == "raise":
+        # ValueError yang bukan safety issue
+        raise e
+    if kind == "fatal":
+        print(f"[LLM Error] Non-retryable API Error: {e}")
+        raise RuntimeError(f"API Error: {str(e)}")
+    
+    # Transient error: retry dengan backoff
+    if kind in _BREAKER_KINDS:
+        _record_failure()
+    if attempt == max_retries - 1:
+        raise RuntimeError(_GIVE_UP_MESSAGES[kind].format(n=max_retries, error=e))
+    
+    wait_time = _backoff(attempt)
+    print(f"[LLM] {_RETRY_LABELS[kind]} (attempt {attempt + 1}/{max_retries}): {e}. "
+          f"Retrying dalam {wait_time:.1f} detik...")
+    return wait_time
+
+
+def _build_messages(prompt: str, context_parts: Sequence[str] = ()) -> List[Dict]:
+    """
+    Build Gemini contents, most stable text first.
+
+    The system prompt goes in as the model's system_instruction; here each
+    context part (callers order them from least to most volatile), then
+    the prompt go in as separate parts, so consecutive calls share the
+    longest possible identical prefix for Gemini's implicit prompt caching.
+    """
+    parts = [{"text": f"{part}\n\n"} for part in context_parts if part]
+    parts.append({"text": prompt})
+
+    return [
+        {
+            "role": "user",
+            "parts": parts
+        }
+    ]
+
+
+@exact_cache
+@coalesce_inflight
+@semantic_cache
+async def ask_llm(
+    prompt: str,
+    system_prompt: str = None,
+    context_parts: Sequence[str] = (),
+    max_retries: int = 3
+):
     """
-    Call Gemini API dengan retry logic untuk handle transient errors.
+    Call Gemini API (async) dengan retry logic untuk handle transient errors.
     
     Args:
-        prompt: Main user prompt
+        prompt: Main user prompt (the question, sent last)
         system_prompt: System instruction (optional)
+        context_parts: Context blocks sent between system prompt and prompt,
+            ordered from most stable (e.g. catalog) to most volatile (history)
         max_retries: Max retry attempts for transient errors
     
     Returns:
@@ -23,106 +231,90 @@ def ask_llm(prompt: str, system_prompt: str = None, max_retries: int = 3):
         ValueError: Jika response di-block oleh safety filter
         RuntimeError: Jika semua retry attempts gagal
     """
-    
-    # Build full prompt with system instruction
-    full_prompt = ""
-    if system_prompt:
-        full_prompt += f"### SYSTEM INSTRUCTION ###\n{system_prompt}\n\n"
-    full_prompt += prompt
-
-    messages = [
-        {
-            "role": "user",
-            "parts": [{"text": full_prompt}]
-        }
-    ]
+    messages = _build_messages(prompt, context_parts)
 
     for attempt in range(max_retries):
+        _check_breaker()
         try:
-            response = model.generate_content(messages)
+            async with get_batch_processor().slot():
+                model = _select_model(system_prompt)
+                response = await model.generate_content_async(messages)
+            _record_success()
             return response.text
         
-        except ValueError as e:
-            """Response blocked by safety filter or empty response"""
-            error_str = str(e).lower()
-            if "block" in error_str or "safety" in error_str or "finish_reason" in error_str:
-                print(f"[LLM Warning] Response blocked by safety filter: {e}")
-                raise ValueError(
-                    "Response tidak bisa diproses karena melanggar content policy. "
-                    "Mohon ajukan pertanyaan yang berbeda."
-                )
-            else:
-                # Re-raise jika bukan safety issue
-                raise
-        
-        except google_exceptions.ResourceExhausted as e:
-            """Rate limiting / Quota exceeded"""
-            wait_time = (2 ** attempt) + 1  # Exponential backoff: 2, 5, 10 seconds
-            print(f"[LLM] Rate limited (attempt {attempt + 1}/{max_retries}). "
-                  f"Menunggu {wait_time} detik sebelum retry...")
-            
-            if attempt == max_retries - 1:
-                raise RuntimeError(
-                    "API quota exceeded atau rate limit. Silakan coba beberapa saat lagi."
-                )
-            time.sleep(wait_time)
-            continue
-        
-        except (google_exceptions.ServiceUnavailable, 
-                google_exceptions.DeadlineExceeded,
-                google_exceptions.InternalServerError) as e:
-            """Timeout/Connection/503 errors (retryable)"""
-            wait_time = (2 ** attempt) + 1
-            print(f"[LLM] Connection error (attempt {attempt + 1}/{max_retries}). "
-                  f"Retrying dalam {wait_time} detik...")
-            
-            if attempt == max_retries - 1:
-                raise RuntimeError(
-                    f"Tidak dapat terhubung ke server AI setelah {max_retries} percobaan. "
-                    f"Silakan coba lagi nanti."
-                )
-            time.sleep(wait_time)
-            continue
-        
-        except google_exceptions.GoogleAPIError as e:
-            """General Google API errors"""
-            error_str = str(e).lower()
-            
-            # Check if it's a retryable error
-            if "timeout" in error_str or "connection" in error_str or "503" in error_str:
-                wait_time = (2 ** attempt) + 1
-                print(f"[LLM] API error (attempt {attempt + 1}/{max_retries}). "
-                      f"Retrying dalam {wait_time} detik...")
-                
-                if attempt == max_retries - 1:
-                    raise RuntimeError(f"API error setelah {max_retries} percobaan: {str(e)}")
-                time.sleep(wait_time)
-                continue
-            
-            # Non-retryable API error
-            print(f"[LLM Error] Non-retryable API Error: {e}")
-            raise RuntimeError(f"API Error: {str(e)}")
-        
         except Exception as e:
-            """Unexpected errors"""
-            error_str = str(e).lower()
-            print(f"[LLM Error] Unexpected error (attempt {attempt + 1}/{max_retries}): {e}")
-            
-            # Check if error message indicates a retryable issue
-            if any(keyword in error_str for keyword in ["timeout", "connection", "503", "502", "500"]):
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt + 1)
-                    continue
-            
-            # Last attempt or non-retryable error
-            if attempt == max_retries - 1:
-                raise RuntimeError(
-                    f"Failed to get response from LLM after {max_retries} attempts. "
-                    f"Error: {str(e)}"
-                )
-            
-            # Retry dengan delay
-            time.sleep(1)
+            wait_time = _retry_delay(e, attempt, max_retries)
+        await asyncio.sleep(wait_time)
     
     # Should not reach here, but just in case
-    raise RuntimeError(f"Max retries ({max_retries}) exceeded without success")
\ No newline at end of file
+    raise RuntimeError(f"Max retries ({max_retries}) exceeded without success")
+
+
+async def ask_llm_stream(
+    prompt: str,
+    system_prompt: str = None,
+    context_parts: Sequence[str] = (),
+    max_retries: int = 3
+) -> AsyncIterator[str]:
+    """
+    Stream a Gemini answer chunk by chunk.
+
+    Uses the same exact-match cache as ask_llm: a cached answer is yielded
+    as a single chunk, and a stream that finished normally is stored in the
+    cache. Opening the stream is retried like ask_llm; once output has been
+    yielded it cannot be retried, so later errors are raised to the caller.
+
+    Args:
+        prompt: Main user prompt (the question, sent last)
+        system_prompt: System instruction (optional)
+        context_parts: Context blocks, most stable first (see ask_llm)
+        max_retries: Max retry attempts for transient errors
+
+    Yields:
+        Text chunks of the response
+
+    Raises:
+        ValueError: Jika response di-block oleh safety filter
+        RuntimeError: Jika semua retry attempts gagal
+    """
+    cache = get_exact_cache()
+    text = cache_text(prompt, context_parts)
+    cached = cache.get(text, system_prompt)
+    if cached is not None:
+        yield cached
+        return
+
+    messages = _build_messages(prompt, context_parts)
+    model = _select_model(system_prompt)
+    chunks = []
+    finish_reason = None
+
+    for attempt in range(max_retries):
+        _check_breaker()
+        async with get_batch_processor().slot():
+            try:
+                response = await model.generate_content_async(messages, stream=True)
+            except Exception as e:
+                wait_time = _retry_delay(e, attempt, max_retries)
+            else:
+                _record_success()
+                if response.prompt_feedback.block_reason:
+                    print(f"[LLM Warning] Prompt blocked by safety filter: {response.prompt_feedback}")
+                    raise ValueError(_SAFETY_MESSAGE)
+
+                async for chunk in response:
+                    if chunk.candidates:
+                        finish_reason = chunk.candidates[0].finish_reason.name
+                    if finish_reason in _BLOCKED_FINISH_REASONS:
+                        print(f"[LLM Warning] Stream stopped by safety filter: {finish_reason}")
+                        raise ValueError(_SAFETY_MESSAGE)
+                    if not chunk.parts:
+                        continue
+                    chunks.append(chunk.text)
+                    yield chunk.text
+                break
+        await asyncio.sleep(wait_time)
+
+    answer = "".join(chunks)
+    if answer and finish_reason == "STOP":
+        cache.set(text, answer, system_prompt)
@@ -1,4 +1,7 @@
-from rag.llm import ask_llm
+import asyncio
+from typing import AsyncIterator, Optional, Union
+
+from rag.llm import ask_llm, ask_llm_stream
 from rag.classifier import classify_query
 from rag.tracking import get_tracker
 from rag.recommendation import get_recommendation_engine
@@ -6,7 +9,20 @@ from rag.history import get_history_manager
 from rag.prompt_loader import load_prompt
 
 
-def learning_answer(query: str, session_id: str = None) -> str:
+async def _history_context(session_id: Optional[str]) -> str:
+    """Get conversation context for a session, empty if no session"""
+    if not session_id:
+        return ""
+    history_manager = get_history_manager()
+    return await history_manager.get_conversation_context(session_id, last_n=3)
+
+
+async def learning_answer(
+    query: str,
+    session_id: str = None,
+    history_context: Optional[str] = None,
+    stream: bool = False
+) -> Union[str, AsyncIterator[str]]:
     """
     ✅ Answer learning queries WITHOUT RAG.
     Langsung pass ke LLM dengan system prompt saja.
@@ -14,33 +30,30 @@ def learning_answer(query: str, session_id: str = None) -> str:
     Args:
         query: User's learning question
         session_id: Optional session ID for conversation history
+        history_context: Pre-fetched conversation context (skips the history lookup)
+        stream: Return an async iterator of answer chunks instead of the full answer
     
     Returns:
         Answer from LLM
     """
     # Get conversation history if available
-    history_context = ""
-    if session_id:
-        history_manager = get_history_manager()
-        history_context = history_manager.get_conversation_context(session_id, last_n=3)
+    if history_context is None:
+        history_context = await _history_context(session_id)
     
     # Load system prompt untuk learning
     system_prompt = load_prompt("learning")
     
-    # Simple prompt tanpa RAG context - langsung ke LLM
-    prompt = f"""
-{history_context}
-
-PERTANYAAN:
-{query}
-
-JAWABAN:
-"""
+    # Simple prompt tanpa RAG context - langsung ke LLM.
+    # History dikirim terpisah setelah system prompt, pertanyaan paling akhir
+    context_parts = (history_context,)
+    prompt = f"PERTANYAAN:\n{query}\n\nJAWABAN:\n"
     
-    return ask_llm(prompt, system_prompt=system_prompt)
+    if stream:
+        return ask_llm_stream(prompt, system_prompt=system_prompt, context_parts=context_parts)
+    return await ask_llm(prompt, system_prompt=system_prompt, context_parts=context_parts)
 
 
-def smart_answer(query: str, session_id: str = None) -> dict:
+async def smart_answer(query: str, session_id: str = None, stream: bool = False) -> dict:
     """
     Main entry point - classify query dan route ke handler yang tepat.
     
@@ -48,34 +61,43 @@ def smart_answer(query: str, session_id: str = None) -> dict:
     - tracking → retrieve dari API user progress
     - recommendation → retrieve dari JSON data
     - learning → langsung ke LLM (no RAG)
+    
+    With stream=True, "answer" is an async iterator of text chunks.
     """
     
-    # Step 1: Classify query type
-    query_type = classify_query(query)
+    # Step 1: Classify query type + fetch history context concurrently
+    query_type, history_context = await asyncio.gather(
+        classify_query(query),
+        _history_context(session_id),
+        return_exceptions=True
+    )
+    
+    if isinstance(query_type, Exception):
+        print(f"[Pipeline] Classifier failed, falling back to learning: {query_type}")
+        query_type = "learning"
+    if isinstance(history_context, Exception):
+        print(f"[Pipeline] Failed to load history for {session_id}: {history_context}")
+        history_context = ""
     
     # Step 2: Route ke handler yang sesuai
     if query_type == "tracking":
         # ✅ Tracking: Retrieve data dari API, pass ke LLM
         tracker = get_tracker()
-        answer = tracker.answer_tracking_query(query, session_id=session_id)
+        answer = await tracker.answer_tracking_query(
+            query, session_id=session_id, history_context=history_context, stream=stream
+        )
     
     elif query_type == "recommendation":
         # ✅ Recommendation: Retrieve dari JSON, pass ke LLM
         recommendation_engine = get_recommendation_engine()
-        answer = recommendation_engine.answer_recommendation_query(query, session_id=session_id)
+        answer = await recommendation_engine.answer_recommendation_query(
+            query, session_id=session_id, history_context=history_context, stream=stream
+        )
     
     else:  # learning
         # ✅ Learning: LANGSUNG KE LLM (no RAG, no embedding, no vector search)
-        answer = learning_answer(query, session_id=session_id)
-    
-    # Step 3: Save ke history jika ada session_id
-    if session_id:
-        history_manager = get_history_manager()
-        history_manager.save_message(
-            session_id=session_id,
-            query=query,
-            answer=answer,
-            query_type=query_type
+        answer = await learning_answer(
+            query, session_id=session_id, history_context=history_context, stream=stream
         )
     
     return {
@@ -2,7 +2,10 @@
 Utility untuk load system prompts dari file .txt
 """
 
+import functools
+import threading
 from pathlib import Path
+from string import Template
 from typing import Dict, Optional
 
 class PromptLoader:
@@ -11,6 +14,7 @@ class PromptLoader:
     def __init__(self, prompts_dir: str = "prompts"):
         self.prompts_dir = Path(prompts_dir)
         self._cache: Dict[str, str] = {}
+        self._templates: Dict[str, Template] = {}
         
         # Create prompts directory if not exists
         self.prompts_dir.mkdir(exist_ok=True)
@@ -35,20 +39,36 @@ class PromptLoader:
         # Load from file
         prompt_path = self.prompts_dir / f"{prompt_name}.txt"
         
-        if not prompt_path.exists():
+        try:
+            with open(prompt_path, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+        except FileNotFoundError:
             raise FileNotFoundError(
                 f"Prompt file not found: {prompt_path}\n"
                 f"Please create the file with appropriate system prompt."
-            )
-        
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
+            ) from None
         
         # Cache it
         self._cache[prompt_name] = content
         
         return content
     
+    def load_template(self, prompt_name: str) -> Template:
+        """
+        Load prompt file as a string.Template ($placeholders), compiled once.
+        
+        Args:
+            prompt_name: Name of prompt file (without .txt extension)
+        
+        Returns:
+            Template of the prompt file content
+        """
+        template = self._templates.get(prompt_name)
+        if template is None:
+            template = Template(self.load(prompt_name))
+            self._templates[prompt_name] = template
+        return template
+    
     def reload(self, prompt_name: str) -> str:
         """
         Force reload prompt from file (bypass cache).
@@ -56,23 +76,49 @@ class PromptLoader:
         """
         if prompt_name in self._cache:
             del self._cache[prompt_name]
+        self._templates.pop(prompt_name, None)
+        load_prompt.cache_clear()
+        load_template.cache_clear()
         return self.load(prompt_name)
     
     def clear_cache(self):
         """Clear all cached prompts"""
         self._cache.clear()
+        self._templates.clear()
+        load_prompt.cache_clear()
+        load_template.cache_clear()
 
 
 # Singleton instance
 _prompt_loader: Optional[PromptLoader] = None
+_prompt_loader_lock = threading.Lock()
 
 def get_prompt_loader() -> PromptLoader:
     """Get or create PromptLoader instance"""
     global _prompt_loader
     if _prompt_loader is None:
-        _prompt_loader = PromptLoader()
+        with _prompt_loader_lock:
+            if _prompt_loader is None:
+                _prompt_loader = PromptLoader()
     return _prompt_loader
 
+@functools.lru_cache(maxsize=None)
 def load_prompt(prompt_name: str) -> str:
-    """Convenience function to load a prompt"""
-    return get_prompt_loader().load(prompt_name)
\ No newline at end of file
+    """Convenience function to load a prompt (memoized)"""
+    return get_prompt_loader().load(prompt_name)
+
+@functools.lru_cache(maxsize=None)
+def load_template(prompt_name: str) -> Template:
+    """Convenience function to load a prompt template (memoized)"""
+    return get_prompt_loader().load_template(prompt_name)
+
+
+def preload_all(
+    names=("classifier", "learning", "recommendation", "tracking"),
+    templates=("question",)
+) -> None:
+    """Read all prompt files up front so the first request doesn't touch disk"""
+    for name in names:
+        load_prompt(name)
+    for name in templates:
+        load_template(name)
\ No newline at end of file
@@ -1,12 +1,19 @@
-from typing import List, Dict, Optional
+from collections import defaultdict, namedtuple
+from operator import attrgetter
+from typing import AsyncIterator, List, Dict, Optional, Union
 from rag.data_loader import get_data_loader
-from rag.llm import ask_llm
-from rag.prompt_loader import load_prompt
+from rag.llm import ask_llm, ask_llm_stream
+from rag.prompt_loader import load_prompt, load_template
 from rag.history import get_history_manager
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Compact course record for sorting/filtering (defaults applied once)
+Course = namedtuple("Course", "id name level_id path_id")
+_by_level = attrgetter("level_id")
+
 
 class RecommendationEngine:
     """
@@ -17,6 +24,33 @@ class RecommendationEngine:
     def __init__(self):
         self.data_loader = get_data_loader()
 
+        # Name lookups, built once
+        self._level_name_by_id = {
+            l["id"]: l.get("course_level", "Unknown")
+            for l in self.data_loader.course_levels
+        }
+        self._path_name_by_id = {
+            p["learning_path_id"]: p.get("learning_path_name", "Unknown")
+            for p in self.data_loader.learning_paths
+        }
+        self._path_by_lower_name = {
+            p.get("learning_path_name", "").lower(): p
+            for p in self.data_loader.learning_paths
+        }
+
+        # Course records, all and per learning path
+        self._course_records: List[Course] = []
+        self._course_records_by_path: Dict[int, List[Course]] = {}
+        for c in self.data_loader.courses:
+            record = Course(
+                c.get("course_id"),
+                c.get("course_name"),
+                c.get("course_level_str", 1),
+                c.get("learning_path_id")
+            )
+            self._course_records.append(record)
+            self._course_records_by_path.setdefault(record.path_id, []).append(record)
+
     def get_all_learning_paths(self) -> List[Dict]:
         """Get all available learning paths"""
         return self.data_loader.learning_paths
@@ -26,11 +60,8 @@ class RecommendationEngine:
         return self.data_loader.get_courses_by_learning_path(learning_path_id)
 
     def get_learning_path_by_name(self, path_name: str) -> Optional[Dict]:
-        """Get learning path by name"""
-        for path in self.data_loader.learning_paths:
-            if path.get("learning_path_name", "").lower() == path_name.lower():
-                return path
-        return None
+        """Get learning path by name (case-insensitive)"""
+        return self._path_by_lower_name.get(path_name.lower())
 
     def get_recommended_courses(
         self,
@@ -50,41 +81,35 @@ class RecommendationEngine:
             List of recommended courses
         """
         try:
-            courses = self.data_loader.courses
+            courses = self._course_records
 
             # Filter by learning path if specified
             if learning_path_name:
                 path = self.get_learning_path_by_name(learning_path_name)
                 if path:
                     path_id = path.get("learning_path_id")
-                    courses = [c for c in courses if c.get("learning_path_id") == path_id]
+                    courses = self._course_records_by_path.get(path_id, [])
                 else:
                     logger.warning(f"Learning path not found: {learning_path_name}")
                     return []
 
             # Filter by course level if specified
             if course_level:
-                courses = [c for c in courses if c.get("course_level_str") == course_level]
+                courses = [c for c in courses if c.level_id == course_level]
 
-            # Sort by level (ascending)
-            courses.sort(key=lambda c: c.get("course_level_str", 1))
+            # Sort by level (ascending), without reordering the cached lists
+            courses = sorted(courses, key=_by_level)
 
             # Add level name to each course
             recommendations = []
             for course in courses[:limit]:
-                level_id = course.get("course_level_str", 1)
-                level_name = self.data_loader.get_level_name(level_id)
-                path_name = self.data_loader.get_learning_path_name(
-                    course.get("learning_path_id")
-                )
-
                 recommendations.append({
-                    "course_id": course.get("course_id"),
-                    "course_name": course.get("course_name"),
-                    "level_id": level_id,
-                    "level_name": level_name,
-                    "learning_path_id": course.get("learning_path_id"),
-                    "learning_path_name": path_name,
+                    "course_id": course.id,
+                    "course_name": course.name,
+                    "level_id": course.level_id,
+                    "level_name": self._level_name_by_id.get(course.level_id, "Unknown"),
+                    "learning_path_id": course.path_id,
+                    "learning_path_name": self._path_name_by_id.get(course.path_id, "Unknown"),
                 })
 
             return recommendations
@@ -105,30 +130,30 @@ class RecommendationEngine:
         if not courses:
             return f"Tidak ada kursus tersedia untuk {learning_path_name}"
 
-        overview = f"📚 {learning_path_name}\n"
-        overview += f"Total Kursus: {len(courses)}\n\n"
+        parts = [
+            f"📚 {learning_path_name}\n",
+            f"Total Kursus: {len(courses)}\n\n",
+        ]
 
-        # Group by level
-        by_level = {}
-        for course in courses:
-            level_id = course.get("course_level_str", 1)
-            level_name = self.data_loader.get_level_name(level_id)
-            if level_name not in by_level:
-                by_level[level_name] = []
-            by_level[level_name].append(course)
+        # Group by level id, levels in ascending order
+        by_level = defaultdict(list)
+        for course in self._course_records_by_path.get(path_id, []):
+            by_level[course.level_id].append(course)
 
-        for level_name in sorted(by_level.keys()):
-            overview += f"\n{level_name}:\n"
-            for course in by_level[level_name]:
-                overview += f"  - {course.get('course_name')}\n"
+        for level_id in sorted(by_level):
+            level_name = self._level_name_by_id.get(level_id, "Unknown")
+            parts.append(f"\n{level_name}:\n")
+            parts.extend(f"  - {course.name}\n" for course in by_level[level_id])
 
-        return overview
+        return "".join(parts)
 
-    def answer_recommendation_query(
+    async def answer_recommendation_query(
         self,
         query: str,
-        session_id: str = None
-    ) -> str:
+        session_id: str = None,
+        history_context: Optional[str] = None,
+        stream: bool = False
+    ) -> Union[str, AsyncIterator[str]]:
         """
         ✅ Answer recommendation queries.
         Retrieve data dari JSON → Pass ke LLM (no RAG)
@@ -136,17 +161,20 @@ class RecommendationEngine:
         Args:
             query: User's question
             session_id: Optional session ID for conversation history
+            history_context: Pre-fetched conversation context (skips the history lookup)
+            stream: Return an async iterator of answer chunks instead of the full answer
         
         Returns:
             Recommendation answer from LLM
         """
         try:
-            history_context = ""
-            if session_id:
-                history_manager = get_history_manager()
-                history_context = history_manager.get_conversation_context(
-                    session_id, last_n=3
-                )
+            if history_context is None:
+                history_context = ""
+                if session_id:
+                    history_manager = get_history_manager()
+                    history_context = await history_manager.get_conversation_context(
+                        session_id, last_n=3
+                    )
 
             # Get all learning paths
             all_paths = self.get_all_learning_paths()
@@ -163,40 +191,37 @@ class RecommendationEngine:
             # Get all courses (limit untuk context, no embedding)
             all_courses = self.data_loader.courses[:20]  # Limit ke 20 courses
             
-            context = "LEARNING PATHS TERSEDIA:\n"
-            context += paths_list + "\n\n"
-
-            context += "COURSE LEVELS:\n"
-            context += levels_list + "\n\n"
-
-            context += "SAMPLE KURSUS (dari total {}):\n".format(len(self.data_loader.courses))
+            parts = [
+                "LEARNING PATHS TERSEDIA:\n",
+                paths_list, "\n\n",
+                "COURSE LEVELS:\n",
+                levels_list, "\n\n",
+                "SAMPLE KURSUS (dari total {}):\n".format(len(self.data_loader.courses)),
+            ]
             for i, course in enumerate(all_courses, 1):
-                level_name = self.data_loader.get_level_name(
-                    course.get("course_level_str", 1)
+                level_name = self._level_name_by_id.get(
+                    course.get("course_level_str", 1), "Unknown"
                 )
-                path_name = self.data_loader.get_learning_path_name(
-                    course.get("learning_path_id")
+                path_name = self._path_name_by_id.get(
+                    course.get("learning_path_id"), "Unknown"
                 )
-                context += (
+                parts.append(
                     f"{i}. {course.get('course_name')}\n"
                     f"   Path: {path_name} | Level: {level_name}\n"
                 )
+            context = "".join(parts)
 
             # Load system prompt
             system_prompt = load_prompt("recommendation")
 
-            # Build final prompt
-            prompt = f"""
-{history_context}
-
-{context}
-
-PERTANYAAN USER:
-{query}
+            # Katalog (stabil) dulu, history (berubah tiap giliran) sesudahnya,
+            # pertanyaan paling akhir supaya prefix prompt bisa di-cache
+            context_parts = (context, history_context)
+            prompt = load_template("question").substitute(query=query)
 
-JAWABAN:
-"""
-            return ask_llm(prompt, system_prompt=system_prompt)
+            if stream:
+                return ask_llm_stream(prompt, system_prompt=system_prompt, context_parts=context_parts)
+            return await ask_llm(prompt, system_prompt=system_prompt, context_parts=context_parts)
         
         except Exception as e:
             logger.error(f"Error in answer_recommendation_query: {e}")
@@ -205,10 +230,13 @@ JAWABAN:
 
 # Singleton
 _recommendation_engine = None
+_recommendation_engine_lock = threading.Lock()
 
 
 def get_recommendation_engine() -> RecommendationEngine:
     global _recommendation_engine
     if _recommendation_engine is None:
-        _recommendation_engine = RecommendationEngine()
+        with _recommendation_engine_lock:
+            if _recommendation_engine is None:
+                _recommendation_engine = RecommendationEngine()
     return _recommendation_engine
\ No newline at end of file
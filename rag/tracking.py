@@ -1,14 +1,61 @@
+import asyncio
 import json
 import os
-import requests
-from typing import Dict, Any
-from datetime import datetime
+import httpx
+import numpy as np
+import orjson
+import threading
+from collections import namedtuple
+from typing import Any, AsyncIterator, Dict, FrozenSet, Optional, Tuple, Union
+from datetime import date
 from dotenv import load_dotenv
 
-from rag.llm import ask_llm
-from rag.prompt_loader import load_prompt
+from rag.llm import ask_llm, ask_llm_stream
+from rag.classifier import classify_tracking_focus
+from rag.prompt_loader import load_prompt, load_template
 from rag.history import get_history_manager
 
+# One course of the user's progress; deadline_date is the parsed deadline (or None)
+CourseProgress = namedtuple(
+    "CourseProgress", "course_id course_name progress deadline deadline_date"
+)
+
+# Sections of the progress context
+ALL_SECTIONS: FrozenSet[str] = frozenset(
+    ("stats", "deadlines", "completed", "in_progress", "not_started")
+)
+
+# Always sent: prompts/tracking.txt requires the completed courses, and
+# picks the Dico/Dingding persona from in-progress courses and deadlines
+REQUIRED_SECTIONS: FrozenSet[str] = frozenset(("completed", "in_progress", "deadlines"))
+
+# Tracking query focus (see classify_tracking_focus) -> extra sections it needs
+_SECTIONS_BY_FOCUS: Dict[str, FrozenSet[str]] = {
+    "deadline": frozenset(),
+    "completed": frozenset(("stats",)),
+    "progress": frozenset(("stats", "not_started")),
+}
+
+
+def sections_for_query(query: str) -> FrozenSet[str]:
+    """Progress context sections relevant to a tracking query (all if unclear)"""
+    focus = classify_tracking_focus(query)
+    if not focus:
+        return ALL_SECTIONS
+    return REQUIRED_SECTIONS.union(*(_SECTIONS_BY_FOCUS[f] for f in focus))
+
+# Shared keep-alive pool for the user progress API (one per worker)
+_HTTP = httpx.AsyncClient(
+    http2=True,
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=20)
+)
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client (on app shutdown)"""
+    await _HTTP.aclose()
+
 
 class ProgressTracker:
     """
@@ -16,7 +63,10 @@ class ProgressTracker:
     No RAG, no embedding. Langsung retrieve + prompt.
     """
     def __init__(self):
-        """Initialize progress tracker with user data from API (.env)"""
+        """
+        Initialize progress tracker config from .env.
+        User data is fetched from the API by ensure_loaded().
+        """
         load_dotenv()
 
         self.api_url = os.getenv("USER_API_URL")
@@ -27,98 +77,225 @@ class ProgressTracker:
         if not self.user_id:
             raise ValueError("USER_ID not found in .env")
 
-        self.user_data = self._load_data()
+        self._load_lock = asyncio.Lock()
+        self._set_user_data(None)
+
+    async def ensure_loaded(self) -> None:
+        """Fetch user data from the API if it hasn't been loaded yet"""
+        if self.user_data is not None:
+            return
+        async with self._load_lock:
+            # Concurrent first requests share a single fetch
+            if self.user_data is None:
+                self._set_user_data(await self._load_data())
+
+    async def refresh(self) -> None:
+        """Re-fetch user data from the API"""
+        async with self._load_lock:
+            self._set_user_data(await self._load_data())
+
+    def _set_user_data(self, user_data: Optional[Dict[str, Any]]) -> None:
+        """Replace user_data and drop everything derived from the old data"""
+        self.user_data = user_data
+        self._progress_array: Optional[np.ndarray] = None
+        self._deadline_ordinals: Optional[np.ndarray] = None
+        self._aggregates: Optional[Dict[str, Any]] = None
+        # (today, {sections: rendered context}); day-relative numbers change at midnight
+        self._context_cache: Optional[Tuple[date, Dict[FrozenSet[str], str]]] = None
+
+    @staticmethod
+    def _parse_deadline(deadline: Optional[str]) -> Optional[date]:
+        """Parse a YYYY-MM-DD deadline, None if missing or malformed"""
+        if not deadline:
+            return None
+        try:
+            return date.fromisoformat(deadline)
+        except ValueError:
+            return None
 
-    def _load_data(self) -> Dict[str, Any]:
+    async def _load_data(self) -> Dict[str, Any]:
         """Load user progress data from API instead of JSON file"""
         try:
-            response = requests.get(self.api_url, timeout=10)
+            response = await _HTTP.get(self.api_url)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
 
             # Cari user berdasarkan ID
-            target_user = None
-            for u in data.get("users", []):
-                if u["_id"] == self.user_id:
-                    target_user = u
-                    break
+            users_by_id = {u["_id"]: u for u in data.get("users", [])}
+            target_user = users_by_id.get(self.user_id)
 
             if not target_user:
                 raise ValueError(f"User with id {self.user_id} not found")
 
-            # Konversi struktur API → struktur lama
-            converted = {
+            # Konversi class dari API → CourseProgress record
+            courses = []
+            for c in target_user.get("classes", []):
+                progress = c.get("progress", 0)
+                deadline = c.get("deadline")
+                courses.append(CourseProgress(
+                    c.get("course_id"),
+                    c.get("course_name"),
+                    progress if type(progress) is int else int(progress),
+                    deadline,
+                    # Parsed once here so building the context needs no strptime
+                    self._parse_deadline(deadline)
+                ))
+
+            return {
                 "user": {
                     "name": target_user.get("name", ""),
                     "learning_path": "Dicoding Learning Path",
-                    "courses": []
+                    "courses": courses
                 }
             }
 
-            for c in target_user.get("classes", []):
-                converted["user"]["courses"].append({
-                    "course_id": c.get("course_id"),
-                    "course_name": c.get("course_name"),
-                    "progress": int(c.get("progress", 0)),
-                    "deadline": c.get("deadline")
-                })
-
-            return converted
-
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise ConnectionError(f"Failed to load data from API: {e}")
         except ValueError:
             raise
         except Exception as e:
             raise RuntimeError(f"Unexpected error when loading API data: {e}")
 
-    def get_progress_context(self) -> str:
+    @property
+    def progress_array(self) -> np.ndarray:
+        """Progress values (0-100) of the user's courses, in course order"""
+        if self._progress_array is None:
+            courses = self.user_data["user"]["courses"]
+            self._progress_array = np.fromiter(
+                (c.progress for c in courses), dtype=np.int8, count=len(courses)
+            )
+        return self._progress_array
+
+    @property
+    def deadline_ordinals(self) -> np.ndarray:
+        """Deadline of each course as date.toordinal(), 0 if it has none"""
+        if self._deadline_ordinals is None:
+            courses = self.user_data["user"]["courses"]
+            self._deadline_ordinals = np.fromiter(
+                (c.deadline_date.toordinal() if c.deadline_date else 0 for c in courses),
+                dtype=np.int32,
+                count=len(courses)
+            )
+        return self._deadline_ordinals
+
+    @property
+    def aggregates(self) -> Dict[str, Any]:
+        """
+        Progress aggregates for the /progress endpoints, computed once per
+        load of user_data.
+
+        Returns:
+            {"progress": <ProgressResponse fields>, "summary": <summary dict>}
+        """
+        if self._aggregates is None:
+            self._aggregates = self._compute_aggregates()
+        return self._aggregates
+
+    def _compute_aggregates(self) -> Dict[str, Any]:
+        user = self.user_data["user"]
+        courses = user["courses"]
+        progress = self.progress_array
+
+        completed = [courses[i] for i in np.flatnonzero(progress == 100)]
+        in_progress = [courses[i] for i in np.flatnonzero((progress > 0) & (progress < 100))]
+
+        total = len(courses)
+        avg_progress = float(progress.mean()) if total > 0 else 0
+
+        return {
+            "progress": {
+                "user_name": user["name"],
+                "learning_path": user["learning_path"],
+                "total_courses": total,
+                "completed_courses": len(completed),
+                "in_progress_courses": len(in_progress),
+                "completed_names": [c.course_name for c in completed],
+                "in_progress_details": [
+                    {
+                        "course_id": c.course_id,
+                        "course_name": c.course_name,
+                        "progress": c.progress,
+                        "deadline": c.deadline
+                    }
+                    for c in in_progress
+                ]
+            },
+            "summary": {
+                "user_name": user["name"],
+                "learning_path": user["learning_path"],
+                "completion_rate": f"{(len(completed)/total*100):.1f}%" if total > 0 else "0%",
+                "average_progress": f"{avg_progress:.1f}%",
+                "courses_completed": len(completed),
+                "courses_total": total
+            }
+        }
+
+    def get_progress_context(self, sections: FrozenSet[str] = ALL_SECTIONS) -> str:
+        """
+        Context string from user progress data, rendered once per day
+        for each load of user_data and set of sections.
+
+        Args:
+            sections: Which parts to include (subset of ALL_SECTIONS);
+                the user's name and learning path are always included
+        """
+        today = date.today()
+        if self._context_cache is None or self._context_cache[0] != today:
+            self._context_cache = (today, {})
+
+        rendered = self._context_cache[1]
+        context = rendered.get(sections)
+        if context is None:
+            context = self._build_progress_context(today, sections)
+            rendered[sections] = context
+        return context
+
+    def _build_progress_context(self, today: date, sections: FrozenSet[str]) -> str:
         """Build context string from user progress data"""
         user = self.user_data["user"]
-        today = datetime.today().date()
+        courses = user["courses"]
+        progress = self.progress_array
 
-        # Basic statistics
-        total_courses = len(user["courses"])
-        completed_courses = sum(1 for c in user["courses"] if c["progress"] == 100)
-        in_progress_courses = [c for c in user["courses"] if 0 < c["progress"] < 100]
-        not_started = total_courses - completed_courses - len(in_progress_courses)
+        # Statistik (vectorized)
+        completed_idx = np.flatnonzero(progress == 100)
+        in_progress_idx = np.flatnonzero((progress > 0) & (progress < 100))
+        total_progress = int(progress.sum())
 
-        avg_progress = (
-            sum(c["progress"] for c in user["courses"]) / total_courses
-            if total_courses > 0 else 0
-        )
+        total_courses = len(courses)
+        completed_courses = len(completed_idx)
+        in_progress_courses = [courses[i] for i in in_progress_idx]
+        not_started = total_courses - completed_courses - len(in_progress_courses)
+        avg_progress = total_progress / total_courses if total_courses > 0 else 0
 
         # Deadline insights
-        deadlines = []
-        overdue_courses = []
-
-        for c in user["courses"]:
-            if "deadline" in c and c["deadline"]:
-                try:
-                    deadline_date = datetime.strptime(c["deadline"], "%Y-%m-%d").date()
-                    days_left = (deadline_date - today).days
-                    deadlines.append((c["course_name"], deadline_date, days_left))
-
-                    if days_left < 0 and c["progress"] < 100:
-                        overdue_courses.append(
-                            (c["course_name"], abs(days_left))
-                        )
-                except ValueError:
-                    pass
-
-        # Nearest deadline
-        nearest_deadline = min(deadlines, key=lambda x: x[2]) if deadlines else None
+        ordinals = self.deadline_ordinals
+        has_deadline = ordinals > 0
+        days_left = ordinals - today.toordinal()
+
+        # Nearest deadline: (name, days_left)
+        nearest_deadline = None
+        if has_deadline.any():
+            i = int(np.argmin(np.where(has_deadline, days_left, np.iinfo(np.int32).max)))
+            nearest_deadline = (courses[i].course_name, int(days_left[i]))
+
+        overdue_courses = [
+            (courses[i].course_name, int(-days_left[i]))
+            for i in np.flatnonzero(has_deadline & (days_left < 0) & (progress < 100))
+        ]
 
         # Estimate remaining progress
-        remaining_progress = sum(100 - c["progress"] for c in user["courses"])
+        remaining_progress = total_courses * 100 - total_progress
         max_total = total_courses * 100
         remaining_percent = (remaining_progress / max_total * 100) if max_total > 0 else 0
 
-        context = f"""
+        parts = [f"""
 DATA PROGRESS PENGGUNA:
 - Nama: {user['name']}
 - Learning Path: {user['learning_path']}
+"""]
 
+        if "stats" in sections:
+            parts.append(f"""
 STATISTIK UTAMA:
 - Total Kursus: {total_courses}
 - Selesai: {completed_courses} kursus ({(completed_courses/total_courses*100) if total_courses else 0:.0f}%)
@@ -126,84 +303,94 @@ STATISTIK UTAMA:
 - Belum Dimulai: {not_started} kursus
 - Progress Rata-rata: {avg_progress:.0f}%
 - Sisa Progress Total: {remaining_percent:.0f}%
+""")
 
-INSIGHT DEADLINE:
-"""
+        if "deadlines" in sections:
+            parts.append("\nINSIGHT DEADLINE:\n")
 
-        if nearest_deadline:
-            context += f"- Deadline terdekat: {nearest_deadline[0]} ({nearest_deadline[2]} hari lagi)\n"
+            if nearest_deadline:
+                parts.append(f"- Deadline terdekat: {nearest_deadline[0]} ({nearest_deadline[1]} hari lagi)\n")
 
-        if overdue_courses:
-            context += "- Kursus terlambat:\n"
-            for name, days in overdue_courses:
-                context += f"  ⚠️ {name} (terlambat {days} hari)\n"
-        else:
-            context += "- Tidak ada kursus yang terlambat ✅\n"
+            if overdue_courses:
+                parts.append("- Kursus terlambat:\n")
+                for name, days in overdue_courses:
+                    parts.append(f"  ⚠️ {name} (terlambat {days} hari)\n")
+            else:
+                parts.append("- Tidak ada kursus yang terlambat ✅\n")
 
-        context += "\nDETAIL KURSUS:\n"
+        if sections & {"completed", "in_progress", "not_started"}:
+            parts.append("\nDETAIL KURSUS:\n")
 
         # Completed
-        if completed_courses > 0:
-            context += "\n✅ KURSUS SELESAI:\n"
-            for course in user["courses"]:
-                if course["progress"] == 100:
-                    context += f"  - {course['course_name']}\n"
+        if "completed" in sections and completed_courses > 0:
+            parts.append("\n✅ KURSUS SELESAI:\n")
+            for i in completed_idx:
+                parts.append(f"  - {courses[i].course_name}\n")
 
         # In progress
-        if in_progress_courses:
-            context += "\n⏳ SEDANG BERJALAN:\n"
-            for course in in_progress_courses:
+        if "in_progress" in sections and in_progress_courses:
+            parts.append("\n⏳ SEDANG BERJALAN:\n")
+            for i in in_progress_idx:
+                course = courses[i]
                 days_info = ""
-                if "deadline" in course and course["deadline"]:
-                    try:
-                        d = datetime.strptime(course["deadline"], "%Y-%m-%d").date()
-                        days_left = (d - today).days
-                        days_info = f" | {days_left} hari menuju deadline"
-                    except ValueError:
-                        pass
-
-                context += (
-                    f"  - {course['course_name']}: {course['progress']}%{days_info}\n"
+                if has_deadline[i]:
+                    days_info = f" | {days_left[i]} hari menuju deadline"
+
+                parts.append(
+                    f"  - {course.course_name}: {course.progress}%{days_info}\n"
                 )
 
         # Not started
-        if not_started > 0:
-            context += f"\n📋 BELUM DIMULAI: {not_started} kursus\n"
-
-        return context
-
-    def answer_tracking_query(self, query: str, session_id: str = None) -> str:
+        if "not_started" in sections and not_started > 0:
+            parts.append(f"\n📋 BELUM DIMULAI: {not_started} kursus\n")
+
+        return "".join(parts)
+
+    async def answer_tracking_query(
+        self,
+        query: str,
+        session_id: str = None,
+        history_context: Optional[str] = None,
+        stream: bool = False
+    ) -> Union[str, AsyncIterator[str]]:
         """
         ✅ Answer progress tracking questions.
         Retrieve data dari API → Pass ke LLM (no RAG)
+        With stream=True, returns an async iterator of answer chunks.
         """
-        history_context = ""
-        if session_id:
-            history_manager = get_history_manager()
-            history_context = history_manager.get_conversation_context(session_id, last_n=3)
+        await self.ensure_loaded()
 
-        context = self.get_progress_context()
-        system_prompt = load_prompt("tracking")
-
-        prompt = f"""
-{history_context}
+        if history_context is None:
+            history_context = ""
+            if session_id:
+                history_manager = get_history_manager()
+                history_context = await history_manager.get_conversation_context(session_id, last_n=3)
 
-{context}
+        # Only the sections the question is about (fewer prompt tokens)
+        context = self.get_progress_context(sections_for_query(query))
+        system_prompt = load_prompt("tracking")
 
-PERTANYAAN USER:
-{query}
+        # Progress user (stabil) dulu, history sesudahnya, pertanyaan paling akhir
+        context_parts = (context, history_context)
+        prompt = load_template("question").substitute(query=query)
 
-JAWABAN:
-"""
-        return ask_llm(prompt, system_prompt=system_prompt)
+        if stream:
+            return ask_llm_stream(prompt, system_prompt=system_prompt, context_parts=context_parts)
+        return await ask_llm(prompt, system_prompt=system_prompt, context_parts=context_parts)
 
 
 # Singleton instance
 _tracker = None
+_tracker_lock = threading.Lock()
 
 def get_tracker() -> ProgressTracker:
-    """Get or create ProgressTracker instance"""
+    """
+    Get or create ProgressTracker instance.
+    Await tracker.ensure_loaded() before reading user_data.
+    """
     global _tracker
     if _tracker is None:
-        _tracker = ProgressTracker()
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = ProgressTracker()
     return _tracker
\ No newline at end of file
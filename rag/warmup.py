@@ -0,0 +1,56 @@
+"""
+Eager startup initialization, so the first request doesn't pay for it
+"""
+
+import asyncio
+
+from rag.cache import get_semantic_cache
+from rag.data_loader import get_data_loader
+from rag.history import get_history_manager
+from rag.llm import init_llm
+from rag.prompt_loader import preload_all
+from rag.recommendation import get_recommendation_engine
+from rag.tracking import get_tracker
+
+
+async def _warm_data() -> None:
+    """Load all data files concurrently, then build indexes and the recommendation engine"""
+    loader = get_data_loader()
+    await asyncio.gather(
+        asyncio.to_thread(lambda: loader.courses),
+        asyncio.to_thread(lambda: loader.learning_paths),
+        asyncio.to_thread(lambda: loader.course_levels),
+        asyncio.to_thread(lambda: loader.tutorials),
+    )
+    loader.build_indexes()
+    await asyncio.to_thread(get_recommendation_engine)
+
+
+async def _warm_tracker() -> None:
+    """Fetch user progress from the API"""
+    try:
+        await get_tracker().ensure_loaded()
+    except Exception as e:
+        # API down / env missing shouldn't block startup; /progress will report it
+        print(f"⚠️ Warning: Progress tracker warmup failed: {e}")
+
+
+def _warm_llm() -> None:
+    """Create the shared Gemini client inside this worker's event loop"""
+    try:
+        init_llm()
+    except Exception as e:
+        # Don't block startup (e.g. missing API key); /chat will report the error
+        print(f"⚠️ Warning: Gemini client init failed: {e}")
+
+
+async def warmup() -> None:
+    """Initialize every singleton; independent parts run concurrently"""
+    _warm_llm()
+    await asyncio.gather(
+        _warm_data(),
+        asyncio.to_thread(preload_all),
+        asyncio.to_thread(get_history_manager),
+        asyncio.to_thread(get_semantic_cache),
+        _warm_tracker(),
+    )